@@ -1,3 +1,4 @@
+from django.db import IntegrityError, transaction
 from rest_framework import status
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
@@ -5,30 +6,32 @@ from recipes.models import Recipe
 
 
 def handle_recipe_operation(request, pk, model, serializer_class):
-    recipe = get_object_or_404(Recipe, pk=pk)
-
     if request.method == 'POST':
-        serializer = serializer_class(
-            data={
-                'user': request.user.id,
-                'recipe': recipe.id
-            },
-            context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        recipe = get_object_or_404(Recipe, pk=pk)
+        # Повторное добавление отсекает уникальное ограничение в БД
+        try:
+            with transaction.atomic():
+                item = model.objects.create(user=request.user, recipe=recipe)
+        except IntegrityError:
+            return Response(
+                {"non_field_errors": [
+                    f"Рецепт уже есть в {model._meta.verbose_name}."
+                ]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = serializer_class(item, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    item = model.objects.filter(
+    deleted, _ = model.objects.filter(
         user=request.user,
-        recipe=recipe
-    ).first()
+        recipe_id=pk
+    ).delete()
 
-    if not item:
+    if not deleted:
+        get_object_or_404(Recipe, pk=pk)
         return Response(
             {"detail": f"Рецепт не найден в {model._meta.verbose_name}."},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    item.delete()
-    return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    return Response(status=status.HTTP_204_NO_CONTENT)
@@ -1,12 +1,30 @@
 import base64
+import tempfile
+from functools import lru_cache
 
 import rest_framework.serializers as slz
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 
 BASE62 = (
     "0123456789abcdefghijklmnopqrstuvwxyz"
     "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 )
+# Размер порции base64 кратен 4, чтобы каждая порция декодировалась отдельно
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+def decode_base64_file(imgstr):
+    """Декодирует base64-строку по частям во временный файл."""
+    # Переносы строк MIME сбивают группы по 4 символа между порциями
+    imgstr = ''.join(imgstr.split())
+    tmp = tempfile.TemporaryFile()
+    for start in range(0, len(imgstr), BASE64_CHUNK_SIZE):
+        tmp.write(base64.b64decode(
+            imgstr[start:start + BASE64_CHUNK_SIZE], validate=True
+        ))
+    tmp.seek(0)
+    return File(tmp)
+
 
 class Base64ImageField(slz.ImageField):
 
@@ -19,6 +37,8 @@ class Base64ImageField(slz.ImageField):
 
 
 class Base62Field:
+    @staticmethod
+    @lru_cache(maxsize=4096)
     def to_base62(num):
         if num == 0:
             return BASE62[0]
@@ -28,6 +48,8 @@ class Base62Field:
             num //= 62
         return ''.join(reversed(base62))
 
+    @staticmethod
+    @lru_cache(maxsize=4096)
     def from_base62(short_code):
         num = 0
         for char in short_code:
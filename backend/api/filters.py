@@ -1,11 +1,13 @@
 import django_filters
 from recipes.models import Recipe
-from django_filters.rest_framework import BooleanFilter
+from django_filters.rest_framework import BooleanFilter, NumberFilter
 
 
 class RecipeFilter(django_filters.FilterSet):
     is_favorited = BooleanFilter(method='filter_favorites')
     is_in_shopping_cart = BooleanFilter(method='filter_shopping_cart')
+    # Фильтр по id без выборки автора для валидации ModelChoiceFilter
+    author = NumberFilter(field_name='author_id')
 
     class Meta:
         model = Recipe
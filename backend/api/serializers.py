@@ -1,5 +1,7 @@
 from rest_framework import serializers as slz
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Manager
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from rest_framework.exceptions import ValidationError
@@ -10,6 +12,25 @@ from users.models import Follow
 
 User = get_user_model()
 
+# Кэш процесса (LocMem по умолчанию, см. CACHES): сигнал сбрасывает ключ
+# только в том процессе, где сохранён пользователь, в остальных данные
+# автора могут устаревать до AUTHOR_CACHE_TIMEOUT секунд
+AUTHOR_CACHE_KEY = 'author:{}'
+AUTHOR_CACHE_TIMEOUT = 300
+
+
+def user_follows(user, author):
+    """Подписки user на author; author может быть OuterRef."""
+    return Follow.objects.filter(user=user, following=author)
+
+
+def subscription_status(user, author, annotated=None):
+    if not user.is_authenticated:
+        return False
+    if annotated is not None:
+        return annotated
+    return user_follows(user, author).exists()
+
 
 class UserSerializer(DjoserUserSerializer):
     is_subscribed = slz.SerializerMethodField()
@@ -19,10 +40,10 @@ class UserSerializer(DjoserUserSerializer):
         fields = DjoserUserSerializer.Meta.fields + ('is_subscribed', 'avatar')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and obj.follower.filter(user=user).exists()
+        return subscription_status(
+            self.context.get('request').user,
+            obj,
+            getattr(obj, 'is_subscribed', None)
         )
 
     def get_avatar(self, obj):
@@ -46,10 +67,21 @@ class IngredientSerializer(slz.ModelSerializer):
         fields = ['id', 'name', 'measurement_unit']
 
 
+class RecipeListSerializer(slz.ListSerializer):
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        # Данные авторов страницы достаём из кэша одним запросом
+        self.child._author_cache = cache.get_many({
+            AUTHOR_CACHE_KEY.format(recipe.author_id) for recipe in recipes
+        })
+        return super().to_representation(recipes)
+
+
 class RecipeReadSerializer(slz.ModelSerializer):
     is_favorited = slz.SerializerMethodField()
     is_in_shopping_cart = slz.SerializerMethodField()
-    author = UserSerializer(read_only=True)
+    author = slz.SerializerMethodField()
     ingredients = slz.SerializerMethodField()
     image = Base64ImageField()
 
@@ -60,20 +92,52 @@ class RecipeReadSerializer(slz.ModelSerializer):
             'is_in_shopping_cart', 'name', 'image', 'text',
             'cooking_time',
         )
+        list_serializer_class = RecipeListSerializer
+
+    def get_author(self, obj):
+        key = AUTHOR_CACHE_KEY.format(obj.author_id)
+        author_cache = getattr(self, '_author_cache', None)
+        if author_cache is None:
+            author_cache = self._author_cache = cache.get_many([key])
+
+        data = author_cache.get(key)
+        if data is None:
+            # В кэше аватар хранится без хоста, подписка - своя у каждого
+            serializer = UserSerializer(obj.author, context=self.context)
+            serializer.fields.pop('is_subscribed')
+            data = dict(serializer.data)
+            data['avatar'] = (
+                obj.author.avatar.url if obj.author.avatar else None
+            )
+            cache.set(key, data, AUTHOR_CACHE_TIMEOUT)
+            author_cache[key] = data
+
+        request = self.context.get('request')
+        data = dict(data)
+        if data['avatar']:
+            data['avatar'] = request.build_absolute_uri(data['avatar'])
+        data['is_subscribed'] = subscription_status(
+            request.user,
+            obj.author,
+            getattr(obj, 'author_is_subscribed', None)
+        )
+        return data
 
     def get_is_in_shopping_cart(self, obj):
         user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and obj.shopping_carts.filter(user=user).exists()
-        )
+        if not user.is_authenticated:
+            return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.shopping_carts.filter(user=user).exists()
 
     def get_is_favorited(self, obj):
         user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and obj.favorites.filter(user=user).exists()
-        )
+        if not user.is_authenticated:
+            return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return obj.favorites.filter(user=user).exists()
 
     def get_ingredients(self, obj):
         ingredients = []
@@ -156,7 +220,7 @@ class ShortRecipeSerializer(slz.ModelSerializer):
 
 class FollowSerializer(UserSerializer):
     recipes = slz.SerializerMethodField()
-    recipes_count = slz.ReadOnlyField(source='recipes.count')
+    recipes_count = slz.SerializerMethodField()
 
     class Meta(UserSerializer.Meta):
         fields = (
@@ -168,6 +232,9 @@ class FollowSerializer(UserSerializer):
         request = self.context.get('request')
         recipes_limit = request.query_params.get('recipes_limit') if request else None
         recipes = obj.recipes.all()
+        # Срез списка, а не queryset, чтобы не сбрасывать prefetch-кэш
+        if 'recipes' in getattr(obj, '_prefetched_objects_cache', {}):
+            recipes = list(recipes)
 
         if recipes_limit and recipes_limit.isdigit():
             recipes = recipes[:int(recipes_limit)]
@@ -176,6 +243,11 @@ class FollowSerializer(UserSerializer):
             recipes, many=True, context=self.context
         ).data
 
+    def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        return obj.recipes.count()
+
 
 class SubscriptionSerializer(slz.Serializer):
     following_id = slz.IntegerField()
@@ -186,8 +258,6 @@ class SubscriptionSerializer(slz.Serializer):
 
         if following_user == user:
             raise slz.ValidationError("Невозможно подписаться на себя")
-        if Follow.objects.filter(user=user, following=following_user).exists():
-            raise slz.ValidationError("Вы уже подписаны на этого пользователя")
         return value
 
     def create(self, validated_data):
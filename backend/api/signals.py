@@ -0,0 +1,14 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.serializers import AUTHOR_CACHE_KEY
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_author_cache(sender, instance, **kwargs):
+    cache.delete(AUTHOR_CACHE_KEY.format(instance.pk))
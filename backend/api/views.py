@@ -1,17 +1,28 @@
-import base64
 import csv
+import hashlib
 import os
 import uuid
 from io import StringIO
-from fpdf import FPDF
+from itertools import islice
+from urllib.parse import urlencode
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.contrib.postgres.aggregates import StringAgg
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import (CharField, Count, Exists, OuterRef, Prefetch,
+                              Sum, Value)
+from django.db.models.functions import Cast, Concat
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
@@ -19,27 +30,50 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 
 from api.abstractions.views import handle_recipe_operation
-from api.fields import Base62Field
+from api.fields import Base62Field, decode_base64_file
 from api.filters import RecipeFilter
 from api.paginations import Pagination
 from api.permissions import IsAuthorOrReadOnly
 from api.serializers import (FavoriteSerializer, FollowSerializer,
                              IngredientSerializer, RecipeReadSerializer,
                              RecipeWriteSerializer, ShoppingCartSerializer,
-                             SubscriptionSerializer, UserSerializer)
+                             SubscriptionSerializer, UserSerializer,
+                             user_follows)
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                             ShoppingCart)
 from users.models import Follow
 
 User = get_user_model()
 
+INGREDIENTS_CACHE_TIMEOUT = 300
+EXPORT_CHUNK_SIZE = 500
+
+# Шрифт с кириллицей регистрируется один раз при загрузке модуля
+if os.path.exists(settings.PDF_FONT_PATH):
+    pdfmetrics.registerFont(TTFont('ShoppingListFont', settings.PDF_FONT_PATH))
+    PDF_FONT = 'ShoppingListFont'
+else:
+    PDF_FONT = 'Helvetica'
+PDF_LINE_POSITIONS = range(int(A4[1]) - 70, 40, -15)
+
 
 class UserViewSet(DjoserUserViewSet):
-    queryset = User.objects.all().order_by('username')
+    queryset = User.objects.only(
+        'id', 'username', 'email', 'first_name', 'last_name', 'avatar'
+    ).order_by('username')
     serializer_class = UserSerializer
     pagination_class = Pagination
     permission_classes = [permissions.AllowAny]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_subscribed=Exists(user_follows(user, OuterRef('pk')))
+            )
+        return queryset
+
     @action(
         detail=False,
         methods=['get'],
@@ -67,19 +101,22 @@ class UserViewSet(DjoserUserViewSet):
                 )
 
             try:
-                # Удаляем старый аватар, если есть
-                if user.avatar:
-                    if os.path.exists(user.avatar.path):
-                        os.remove(user.avatar.path)
-                    user.avatar.delete()
-
-                # Обрабатываем новое изображение
                 format, imgstr = avatar_data.split(';base64,')
                 ext = format.split('/')[-1]
-                data = ContentFile(base64.b64decode(imgstr), name=f"{uuid.uuid4()}.{ext}")
 
-                # Сохраняем новый аватар
-                user.avatar.save(data.name, data, save=True)
+                # Декодируем изображение по частям и сохраняем через storage
+                with decode_base64_file(imgstr) as data:
+                    name = user.avatar.field.generate_filename(
+                        user, f"{uuid.uuid4()}.{ext}"
+                    )
+                    name = user.avatar.storage.save(name, data)
+
+                # Удаляем старый аватар, если есть
+                if user.avatar:
+                    user.avatar.delete(save=False)
+
+                user.avatar.name = name
+                user.save(update_fields=['avatar'])
                 avatar_url = request.build_absolute_uri(user.avatar.url)
                 return Response({"avatar": avatar_url}, status=status.HTTP_200_OK)
 
@@ -91,11 +128,8 @@ class UserViewSet(DjoserUserViewSet):
 
         # Удаление аватара
         if user.avatar:
-            avatar_path = user.avatar.path
-            if os.path.exists(avatar_path):
-                os.remove(avatar_path)
-            user.avatar.delete()
-            user.save()
+            user.avatar.delete(save=False)
+            user.save(update_fields=['avatar'])
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response(
@@ -118,7 +152,17 @@ class UserViewSet(DjoserUserViewSet):
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            follow = serializer.save()
+            # Повторную подписку отсекает уникальное ограничение в БД
+            try:
+                with transaction.atomic():
+                    follow = serializer.save()
+            except IntegrityError:
+                return Response(
+                    {"following_id": [
+                        "Вы уже подписаны на этого пользователя"
+                    ]},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             return Response(
                 FollowSerializer(
                     follow.following,
@@ -127,19 +171,18 @@ class UserViewSet(DjoserUserViewSet):
                 status=status.HTTP_201_CREATED
             )
 
-        following_user = get_object_or_404(User, pk=id)
-        follow_instance = Follow.objects.filter(
-            user=user,
-            following=following_user
-        ).first()
+        deleted, _ = Follow.objects.filter(
+            user_id=user.id,
+            following_id=id
+        ).delete()
 
-        if not follow_instance:
+        if not deleted:
+            get_object_or_404(User, pk=id)
             return Response(
                 {"detail": "Вы не подписаны на этого пользователя."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        follow_instance.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -150,7 +193,19 @@ class UserViewSet(DjoserUserViewSet):
     )
     def list_subscriptions(self, request):
         user = request.user
-        subscriptions = User.objects.filter(following__user=user)
+        subscriptions = User.objects.filter(
+            following__user=user
+        ).annotate(
+            recipes_count=Count('recipes'),
+            is_subscribed=Value(True)
+        ).prefetch_related(
+            Prefetch(
+                'recipes',
+                queryset=Recipe.objects.only(
+                    'id', 'author_id', 'name', 'image', 'cooking_time'
+                )
+            )
+        )
         page = self.paginate_queryset(subscriptions)
         serializer = FollowSerializer(
             page,
@@ -161,7 +216,7 @@ class UserViewSet(DjoserUserViewSet):
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all().select_related('author').prefetch_related('ingredients')
+    queryset = Recipe.objects.all()
     permission_classes = [
         permissions.IsAuthenticatedOrReadOnly,
         IsAuthorOrReadOnly
@@ -170,6 +225,36 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        queryset = super().get_queryset().select_related(
+            'author'
+        ).only(
+            'id', 'name', 'image', 'text', 'cooking_time',
+            'author__id', 'author__username', 'author__email',
+            'author__first_name', 'author__last_name', 'author__avatar'
+        ).prefetch_related(
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_favorited=Exists(
+                    Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+                ),
+                is_in_shopping_cart=Exists(
+                    ShoppingCart.objects.filter(
+                        user=user, recipe=OuterRef('pk')
+                    )
+                ),
+                author_is_subscribed=Exists(
+                    user_follows(user, OuterRef('author'))
+                )
+            )
+        return queryset
+
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return RecipeWriteSerializer
@@ -182,10 +267,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[permissions.AllowAny]
     )
     def generate_share_link(self, request, pk=None):
-        recipe = self.get_object()
-        short_code = Base62Field.to_base62(recipe.id)
+        if not pk.isdecimal() or not Recipe.objects.filter(pk=pk).exists():
+            raise Http404
+        short_code = Base62Field.to_base62(int(pk))
         short_link = request.build_absolute_uri(f"/s/{short_code}")
-        return Response({"short-link": short_link}, status=status.HTTP_200_OK)
+        response = Response(
+            {"short-link": short_link}, status=status.HTTP_200_OK
+        )
+        # Ссылка детерминирована по id рецепта, её можно кэшировать
+        patch_cache_control(response, public=True, max_age=86400)
+        return response
 
     @action(
         detail=False,
@@ -194,6 +285,19 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[permissions.IsAuthenticated]
     )
     def export_shopping_cart(self, request):
+        file_format = request.query_params.get('format', 'txt').lower()
+        handler = {
+            'txt': self._generate_text_response,
+            'csv': self._generate_csv_response,
+            'pdf': self._generate_pdf_response,
+        }.get(file_format)
+
+        if handler is None:
+            return Response(
+                {"detail": "Неподдерживаемый формат файла"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         # Получаем список ингредиентов
         ingredients = (
             RecipeIngredient.objects
@@ -205,74 +309,93 @@ class RecipeViewSet(viewsets.ModelViewSet):
             .annotate(total_amount=Sum('amount'))
             .order_by('ingredient__name')
         )
+        return handler(ingredients)
 
-        ingredients_list = [
-            {
-                'name': item['ingredient__name'],
-                'amount': item['total_amount'],
-                'measurement_unit': item['ingredient__measurement_unit']
-            }
-            for item in ingredients
-        ]
-
-        file_format = request.query_params.get('format', 'txt').lower()
-
-        if file_format == 'txt':
-            return self._generate_text_response(ingredients_list)
-        elif file_format == 'csv':
-            return self._generate_csv_response(ingredients_list)
-        elif file_format == 'pdf':
-            return self._generate_pdf_response(ingredients_list)
-        else:
-            return Response(
-                {"detail": "Неподдерживаемый формат файла"},
-                status=status.HTTP_400_BAD_REQUEST
+    def _annotate_lines(self, ingredients):
+        # Строка списка покупок собирается в БД одним столбцом
+        return ingredients.annotate(
+            line=Concat(
+                'ingredient__name',
+                Value(' ('),
+                'ingredient__measurement_unit',
+                Value(') — '),
+                Cast('total_amount', CharField())
             )
+        )
 
     def _generate_text_response(self, ingredients):
-        content = "\n".join(
-            f"{item['name']} ({item['measurement_unit']}) — {item['amount']}"
-            for item in ingredients
-        )
-        response = HttpResponse(content, content_type="text/plain")
+        # Обе ветки сортируют по line и завершают каждую строку переводом
+        lines = self._annotate_lines(ingredients)
+        if connection.vendor == 'postgresql':
+            # Склеиваем строки списка одним агрегатом на стороне БД
+            content = lines.aggregate(
+                content=StringAgg('line', delimiter='\n', ordering='line')
+            )['content']
+            response = HttpResponse(
+                f'{content}\n' if content else '', content_type="text/plain"
+            )
+        else:
+            content = (
+                line + '\n'
+                for line in lines.order_by('line').values_list(
+                    'line', flat=True
+                ).iterator(
+                    chunk_size=EXPORT_CHUNK_SIZE
+                )
+            )
+            response = StreamingHttpResponse(
+                content, content_type="text/plain"
+            )
         response['Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
         return response
 
     def _generate_csv_response(self, ingredients):
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Ингредиент', 'Количество', 'Единица измерения'])
-
-        for item in ingredients:
-            writer.writerow([
-                item['name'],
-                item['amount'],
-                item['measurement_unit']
-            ])
-
-        response = HttpResponse(output.getvalue(), content_type="text/csv")
+        rows = ingredients.values_list(
+            'ingredient__name',
+            'total_amount',
+            'ingredient__measurement_unit'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+        def chunks():
+            output = StringIO()
+            writer = csv.writer(output)
+            writer.writerow(['Ингредиент', 'Количество', 'Единица измерения'])
+            while True:
+                writer.writerows(islice(rows, EXPORT_CHUNK_SIZE))
+                content = output.getvalue()
+                if not content:
+                    return
+                yield content
+                output.seek(0)
+                output.truncate()
+
+        response = StreamingHttpResponse(chunks(), content_type="text/csv")
         response['Content-Disposition'] = 'attachment; filename="shopping_list.csv"'
         return response
 
     def _generate_pdf_response(self, ingredients):
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        pdf.cell(200, 10, txt="Список покупок", ln=True, align='C')
-
-        for item in ingredients:
-            pdf.cell(
-                200,
-                10,
-                txt=f"{item['name']} ({item['measurement_unit']}) — {item['amount']}",
-                ln=True
-            )
+        response = HttpResponse(content_type='application/pdf')
+        response['Content-Disposition'] = 'attachment; filename="shopping_list.pdf"'
 
-        response = HttpResponse(
-            pdf.output(dest='S').encode('latin1'),
-            content_type='application/pdf'
+        pdf = canvas.Canvas(response, pagesize=A4)
+        pdf.setFont(PDF_FONT, 12)
+        pdf.drawCentredString(A4[0] / 2, A4[1] - 40, "Список покупок")
+
+        lines = self._annotate_lines(ingredients).values_list(
+            'line', flat=True
         )
-        response['Content-Disposition'] = 'attachment; filename="shopping_list.pdf"'
+
+        lines_per_page = len(PDF_LINE_POSITIONS)
+        for index, line in enumerate(
+            lines.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        ):
+            position = index % lines_per_page
+            if index and not position:
+                pdf.showPage()
+                pdf.setFont(PDF_FONT, 12)
+            pdf.drawString(40, PDF_LINE_POSITIONS[position], line)
+
+        pdf.save()
         return response
 
     @action(
@@ -310,4 +433,14 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
         name = self.request.query_params.get('name')
         if name:
             queryset = queryset.filter(name__istartswith=name)
-        return queryset
\ No newline at end of file
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        # Ключ учитывает все параметры запроса: и name, и search
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        key = f'ingredients:{hashlib.md5(params.encode()).hexdigest()}'
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, INGREDIENTS_CACHE_TIMEOUT)
+        return Response(data)
\ No newline at end of file